@@ -9,17 +9,42 @@ MixpanelTrack is prepared as `request.mixpanel` for easier usage in view code.
 """
 from dataclasses import dataclass
 from pyramid.config import Configurator
-from pyramid.events import NewRequest
+
+import typing as t
+
+
+class _FrozenSlots:
+    """Make frozen dataclasses that define __slots__ copyable and picklable.
+
+    Python 3.10+ does this for you with `@dataclass(slots=True)`.
+    """
+
+    __slots__: t.Tuple[str, ...] = ()
+
+    def __getstate__(self) -> t.List[object]:
+        """Return values of all slots."""
+        return [getattr(self, name) for name in self.__slots__]
+
+    def __setstate__(self, state: t.List[object]) -> None:
+        """Set values of all slots, bypassing frozen __setattr__."""
+        for name, value in zip(self.__slots__, state):
+            object.__setattr__(self, name, value)
 
 
 @dataclass(frozen=True)
-class Event:
+class Event(_FrozenSlots):
     """A single event that we send to Mixpanel."""
 
+    __slots__ = ("name",)
+
     # The name of this event that will be shown in Mixpanel. Should be
     # something nice, like "Page Viewed".
     name: str
 
+    def __hash__(self) -> int:
+        """Hash just the name, str caches its own hash."""
+        return hash(self.name)
+
 
 @dataclass(frozen=True)
 class Events:
@@ -54,15 +79,21 @@ class Events:
 
 
 @dataclass(frozen=True)
-class Property:
+class Property(_FrozenSlots):
     """A single property that we attach to Mixpanel events or profiles."""
 
+    __slots__ = ("name",)
+
     # The name of this property that will be shown in Mixpanel. Should be
     # something nice, like "Path" or "Title". Some properties are ~special~
     # and they are prefixed with the dollar sign ($). Read more about them on
     # https://help.mixpanel.com/hc/en-us/articles/115004602703-Reserved-or-Special-Properties
     name: str
 
+    def __hash__(self) -> int:
+        """Hash just the name, str caches its own hash."""
+        return hash(self.name)
+
 
 @dataclass(frozen=True)
 class EventProperties:
@@ -159,43 +190,34 @@ class ProfileMetaProperties:
 def includeme(config: Configurator) -> None:
     """Pyramid knob."""
     from pyramid_mixpanel.consumer import MockedConsumer
-    from pyramid_mixpanel.track import mixpanel_flush
     from pyramid_mixpanel.track import mixpanel_init
     from pyramid_mixpanel.track import MixpanelTrack
 
     mixpanel = MixpanelTrack(settings=config.registry.settings)
+    context = {
+        "consumer": mixpanel.api._consumer.__class__.__name__,
+        "events": mixpanel.events.__class__.__name__,
+        "event_properties": mixpanel.event_properties.__class__.__name__,
+        "profile_properties": mixpanel.profile_properties.__class__.__name__,
+        "profile_meta_properties": mixpanel.profile_meta_properties.__class__.__name__,
+        "customerio": True if mixpanel.cio else False,
+    }
+
     if config.registry.settings.get("pyramid_heroku.structlog"):
         import structlog
 
         logger = structlog.get_logger(__name__)
-        logger.info(
-            "Mixpanel configured",
-            consumer=mixpanel.api._consumer.__class__.__name__,
-            events=mixpanel.events.__class__.__name__,
-            event_properties=mixpanel.event_properties.__class__.__name__,
-            profile_properties=mixpanel.profile_properties.__class__.__name__,
-            profile_meta_properties=mixpanel.profile_meta_properties.__class__.__name__,
-            customerio=True if mixpanel.cio else False,
-        )
-        if mixpanel.api._consumer.__class__ == MockedConsumer:
-            logger.warning("Mixpanel is in testing mode, no message will be sent!")
-
+        logger.info("Mixpanel configured", **context)
     else:
         import logging
 
         logger = logging.getLogger(__name__)
-
         logger.info(
-            "Mixpanel configured "
-            f"consumer={mixpanel.api._consumer.__class__.__name__}, "
-            f"events={mixpanel.events.__class__.__name__}, "
-            f"event_properties={mixpanel.event_properties.__class__.__name__}, "
-            f"profile_properties={mixpanel.profile_properties.__class__.__name__}, "
-            f"profile_meta_properties={mixpanel.profile_meta_properties.__class__.__name__}, "
-            f"customerio={True if mixpanel.cio else False}"
+            "Mixpanel configured %s",
+            ", ".join(f"{key}={value}" for key, value in context.items()),
         )
-        if mixpanel.api._consumer.__class__ == MockedConsumer:
-            logger.warning("Mixpanel is in testing mode, no message will be sent!")
+
+    if mixpanel.api._consumer.__class__ == MockedConsumer:
+        logger.warning("Mixpanel is in testing mode, no message will be sent!")
 
     config.add_request_method(mixpanel_init, "mixpanel", reify=True)
-    config.add_subscriber(mixpanel_flush, NewRequest)
@@ -3,86 +3,334 @@
 from dataclasses import dataclass
 from dataclasses import field
 from mixpanel import BufferedConsumer
+from mixpanel import Consumer
+from mixpanel import MixpanelException
 from urllib.error import URLError
 
+import atexit
 import json
+import queue
+import threading
+import time
 import typing as t
 
+try:
+    # orjson is an optional, faster drop-in for parsing JSON
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+# Process-wide queue of (endpoint, json_message, api_key, api_secret) tuples
+# that QueuedConsumer fills and a single background thread drains. `None`
+# stops the thread.
+_QUEUE: "queue.Queue[t.Optional[t.Tuple[str, str, t.Any, t.Any]]]"
+_QUEUE = queue.Queue(maxsize=10_000)
+_WORKER: t.Optional[threading.Thread] = None
+_WORKER_LOCK = threading.Lock()
+
+# Consumers that do the actual HTTP requests. requests.Session is not
+# thread-safe, so every thread keeps its own Consumers, shared by all
+# PoliteBufferedConsumers with the same arguments in that thread. That way
+# connections to Mixpanel are reused across the requests a thread serves.
+_LOCAL = threading.local()
+
+# Message properties that MockedConsumer drops, for events and profiles
+_EVENT_DROP = frozenset({"$insert_id", "$lib_version", "mp_lib", "time", "token"})
+_PROFILE_DROP = frozenset({"$token", "$time"})
+
 
 @dataclass
 class MockedConsumer:
     """Save messages in an internal list, useful in unit testing."""
 
     # Internal storage of mocked message
-    mocked_messages: t.List = field(default_factory=lambda: [])
+    mocked_messages: t.List = field(default_factory=list)
 
     # Drop message properties that are usually not needed in testing
     DROP_SYSTEM_MESSAGE_PROPERTIES: bool = True
 
+    # Set MockedConsumer.STORE_MESSAGES to False to skip parsing and storing
+    # messages, for test suites that never look at mocked_messages
+    STORE_MESSAGES: t.ClassVar[bool] = True
+
     # True if .flush() was called
     flushed: bool = False
 
     def send(self, endpoint: str, json_message: str) -> None:
         """Append message to the mocked_messages list."""
-        message = {
-            "endpoint": endpoint,
-            "msg": json.loads(json_message),
-        }
+        if not self.STORE_MESSAGES:
+            return
+
+        msg = _json_loads(json_message)
 
         if self.DROP_SYSTEM_MESSAGE_PROPERTIES:
+            properties = msg.get("properties")
             # Events
-            if "properties" in message["msg"]:
-                message["msg"]["properties"].pop("$insert_id", None)  # type: ignore
-                message["msg"]["properties"].pop("$lib_version", None)  # type: ignore
-                message["msg"]["properties"].pop("mp_lib", None)  # type: ignore
-                message["msg"]["properties"].pop("time", None)  # type: ignore
-                message["msg"]["properties"].pop("token", None)  # type: ignore
+            if properties is not None:
+                for key in _EVENT_DROP:
+                    properties.pop(key, None)
             # Profiles
             else:
-                message["msg"].pop("$token", None)
-                message["msg"].pop("$time", None)
+                for key in _PROFILE_DROP:
+                    msg.pop(key, None)
 
-        self.mocked_messages.append(message)
+        self.mocked_messages.append({"endpoint": endpoint, "msg": msg})
 
     def flush(self, *args, **kwargs) -> None:
         """Set self.flushed to True."""
         self.flushed = True
 
 
+def _json_loads(json_message: str) -> t.Any:
+    """Parse JSON with orjson if it is installed, otherwise with json."""
+    if orjson is not None:
+        try:
+            return orjson.loads(json_message)
+        except orjson.JSONDecodeError:
+            # orjson rejects NaN and Infinity, which mixpanel's json_dumps
+            # writes for float("nan") and float("inf") values
+            pass
+    return json.loads(json_message)
+
+
+def _get_logger(use_structlog: t.Optional[bool] = False) -> t.Any:
+    """Return a structlog or a stdlib logger."""
+    if use_structlog:
+        import structlog
+
+        return structlog.get_logger(__name__)
+    else:
+        import logging
+
+        return logging.getLogger(__name__)
+
+
+def _get_consumer(*args, **kwargs) -> Consumer:
+    """Return this thread's Consumer for the given arguments."""
+    consumers = getattr(_LOCAL, "consumers", None)
+    if consumers is None:
+        consumers = _LOCAL.consumers = {}
+
+    key = (args, tuple(sorted(kwargs.items())))
+    consumer = consumers.get(key)
+    if consumer is None:
+        consumer = consumers[key] = Consumer(*args, **kwargs)
+    return consumer
+
+
 class PoliteBufferedConsumer(BufferedConsumer):
     """Subclass of BufferedConsumer that logs network errors instead of failing.
 
+    Messages are sent in batches, when `max_size` messages are buffered for an
+    endpoint or when flush() is called, which pyramid_mixpanel does at the end
+    of every request.
+
+    If `flush_interval` is set, send() also flushes all buffers once the oldest
+    buffered message is older than `flush_interval` seconds. The age is only
+    checked on send(), so a lone buffered message still waits for the next
+    send() or flush(). It is disabled by default, so that messages of the
+    current request are not sent before the request succeeds.
+
     Inspired by:
     https://github.com/mixpanel/mixpanel-python/issues/36#issuecomment-72063207
     """
 
-    def __init__(self, use_structlog: t.Optional[bool] = False, *args, **kwargs):
-        """Initialize PoliteBufferedConsumer."""
-        super().__init__(*args, **kwargs)
+    def __init__(
+        self,
+        use_structlog: t.Optional[bool] = False,
+        max_size: int = 50,
+        *args,
+        flush_interval: t.Optional[float] = None,
+        **kwargs,
+    ):
+        """Initialize PoliteBufferedConsumer.
+
+        Arguments after `max_size` are passed on to mixpanel's Consumer.
+        """
+        # BufferedConsumer.__init__() is not called, because it creates a new
+        # Consumer, and with it a requests.Session, on every request. These
+        # are the attributes that it sets.
+        self._buffers: t.Dict[str, t.List[str]] = {
+            "events": [],
+            "people": [],
+            "groups": [],
+            "imports": [],
+        }
+        self._max_size = min(50, max_size)
+        self._api_key = None
+        # Buffers are per instance, but HTTP connections are not
+        self._consumer = _get_consumer(*args, **kwargs)
+
         self.use_structlog = use_structlog
+        self._logger = _get_logger(use_structlog)
+        self.flush_interval = flush_interval
+
+        # time.monotonic() of the oldest message that is still buffered
+        self._first_buffered_at: t.Optional[float] = None
+
+    def send(self, endpoint: str, json_message: str, *args, **kwargs) -> None:
+        """Buffer the message and flush if the buffer is too old."""
+        now = time.monotonic()
+        if self._first_buffered_at is None:
+            self._first_buffered_at = now
+
+        super().send(endpoint, json_message, *args, **kwargs)
+
+        if (
+            self.flush_interval is not None
+            and now - self._first_buffered_at > self.flush_interval
+        ):
+            self.flush()
 
     def flush(self, *args, **kwargs) -> None:
         """Try to send updates to Mixpanel."""
+        self._first_buffered_at = None
         try:
             super(PoliteBufferedConsumer, self).flush(*args, **kwargs)
         except URLError:
-            if self.use_structlog:
-                import structlog
+            self._logger.exception("It seems like Mixpanel is down.", exc_info=True)
 
-                logger = structlog.get_logger(__name__)
-                logger.exception("It seems like Mixpanel is down.", exc_info=True)
-            else:
-                import logging
 
-                logger = logging.getLogger(__name__)
-                logger.exception("It seems like Mixpanel is down.", exc_info=True)
+class _WorkerConsumer(PoliteBufferedConsumer):
+    """PoliteBufferedConsumer that drops batches which fail to send.
 
+    BufferedConsumer keeps a batch buffered when sending it fails, so a
+    message that Mixpanel rejects would be retried forever by the background
+    thread, with all later messages stuck behind it. Consumer already retries
+    connection errors and 5xx responses, so a batch that still fails is logged
+    and dropped, and buffers never grow over `max_size` messages.
 
-@dataclass(frozen=True)
-class QueuedConsumer:
-    """Queue sending Mixpanel messages in a separate background queue processor."""
+    Messages with credentials, which are imports, are sent one by one, so
+    that a batch never mixes messages of different projects.
+    """
 
-    def send(self, endpoint: str, json_message: str) -> None:
-        """Queue sending of Mixpanel message in a background task."""
-        # send_api.delay(endpoint, json_message)
-        raise NotImplementedError  # pragma: no cover
+    def send(
+        self,
+        endpoint: str,
+        json_message: str,
+        api_key: t.Any = None,
+        api_secret: t.Any = None,
+    ) -> None:
+        """Buffer the message, or send it right away if it has credentials."""
+        if api_key is None and api_secret is None:
+            super().send(endpoint, json_message)
+        else:
+            self._send(endpoint, json_message, api_key=api_key, api_secret=api_secret)
+
+    def _flush_endpoint(self, endpoint: str) -> None:
+        """Send buffered messages for an endpoint, dropping failed batches."""
+        size = self._max_size
+        buffer = self._buffers[endpoint]
+        while buffer:
+            batch, buffer = buffer[:size], buffer[size:]
+            self._buffers[endpoint] = buffer
+            self._send(endpoint, f"[{','.join(batch)}]", api_key=self._api_key)
+
+    def _send(self, endpoint: str, json_message: str, **credentials) -> None:
+        """Send the message, logging and dropping it if that fails."""
+        try:
+            self._consumer.send(endpoint, json_message, **credentials)
+        except MixpanelException:
+            self._logger.exception(
+                "Failed sending messages to Mixpanel, dropping them.",
+                exc_info=True,
+            )
+
+
+def _worker(use_structlog: t.Optional[bool] = False) -> None:
+    """Send messages from the queue to Mixpanel in batches."""
+    # The thread keeps a buffer across many requests, so make sure that
+    # buffered messages do not wait for a full batch for too long
+    consumer = _WorkerConsumer(use_structlog, flush_interval=1.0)
+    logger = _get_logger(use_structlog)
+
+    def call(method: t.Callable, *args) -> None:
+        """Log Mixpanel errors instead of killing the thread."""
+        try:
+            method(*args)
+        except MixpanelException:
+            logger.exception("Failed sending messages to Mixpanel.", exc_info=True)
+
+    while True:
+        try:
+            item = _QUEUE.get(timeout=0.1)
+        except queue.Empty:
+            # queue is idle, send what we have buffered so far
+            call(consumer.flush)
+            continue
+
+        if item is None:
+            call(consumer.flush)
+            _QUEUE.task_done()
+            return
+
+        call(consumer.send, *item)
+        _QUEUE.task_done()
+
+
+def _start_worker(use_structlog: t.Optional[bool] = False) -> None:
+    """Start the background thread, unless it is already running."""
+    global _WORKER
+    with _WORKER_LOCK:
+        if _WORKER is None or not _WORKER.is_alive():
+            _WORKER = threading.Thread(
+                target=_worker, args=(use_structlog,), daemon=True
+            )
+            _WORKER.start()
+
+
+@atexit.register
+def _stop_worker(timeout: float = 5.0) -> None:
+    """Send all queued messages and stop the background thread."""
+    global _WORKER
+    with _WORKER_LOCK:
+        if _WORKER is None or not _WORKER.is_alive():
+            return
+        try:
+            _QUEUE.put(None, timeout=timeout)
+        except queue.Full:
+            # the thread is not keeping up, do not block interpreter exit
+            return
+        _WORKER.join(timeout)
+        _WORKER = None
+
+
+class QueuedConsumer(BufferedConsumer):
+    """Send Mixpanel messages from a background thread.
+
+    Calling send() only puts the message on a process-wide queue, so
+    request.mixpanel.* calls return immediately instead of waiting for
+    Mixpanel's API. A single daemon thread sends queued messages in batches
+    and the remaining ones are sent when the process exits.
+    """
+
+    def __init__(self, use_structlog: t.Optional[bool] = False):
+        """Initialize QueuedConsumer.
+
+        BufferedConsumer.__init__() is not called, it would create a Consumer
+        and a requests.Session on every request, while only the background
+        thread sends anything.
+        """
+        self.use_structlog = use_structlog
+        self._logger = _get_logger(use_structlog)
+
+    def send(
+        self,
+        endpoint: str,
+        json_message: str,
+        api_key: t.Any = None,
+        api_secret: t.Any = None,
+    ) -> None:
+        """Queue sending of Mixpanel message in a background thread.
+
+        `api_key` and `api_secret` are only passed for imports, see
+        Mixpanel.import_data().
+        """
+        _start_worker(self.use_structlog)
+        try:
+            _QUEUE.put_nowait((endpoint, json_message, api_key, api_secret))
+        except queue.Full:
+            self._logger.warning("Mixpanel queue is full, dropping message.")
+
+    def flush(self, *args, **kwargs) -> None:
+        """Do nothing, queued messages are flushed by the background thread."""
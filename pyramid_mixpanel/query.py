@@ -1,8 +1,60 @@
 """Querying data from Mixpanel."""
 
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import json
 import requests
+import threading
+import time
 import typing as t
 
+try:
+    # orjson is an optional, faster drop-in for parsing JSON
+    from orjson import loads as json_loads
+except ImportError:  # pragma: no cover
+    from json import loads as json_loads
+
+
+# profile_by_email results, (api_secret, email) -> (expires_at, profile),
+# oldest used first
+_PROFILE_CACHE: "OrderedDict[t.Tuple[str, str], t.Tuple[float, t.Dict]]"
+_PROFILE_CACHE = OrderedDict()
+_PROFILE_CACHE_LOCK = threading.Lock()
+
+# requests.Session is not guaranteed to be thread-safe, so every thread keeps
+# its own, shared by all MixpanelQuery instances in that thread.
+_LOCAL = threading.local()
+
+
+def _get_session() -> requests.Session:
+    """Return this thread's Session, created on first use."""
+    session = getattr(_LOCAL, "session", None)
+    if session is None:
+        session = _LOCAL.session = _make_session()
+    return session
+
+
+def _make_session() -> requests.Session:
+    """Return a Session that reuses HTTPS connections and retries on errors."""
+    retry = Retry(
+        total=3,
+        backoff_factor=0.25,
+        # 429 is Mixpanel's rate limit. Retry-After is ignored, because it can
+        # ask for minutes and queries run in web threads; backing off between
+        # the retries waits 1.5 seconds in total.
+        status_forcelist=(429, 500, 502, 503, 504),
+        respect_retry_after_header=False,
+        allowed_methods=frozenset({"POST"}),
+        # return the last response, so that raise_for_status() raises
+        # HTTPError instead of urllib3 raising RetryError
+        raise_on_status=False,
+    )
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(max_retries=retry))
+    return session
+
 
 class MultipleProfilesFoundException(ValueError):
     """Custom exception for multiple profiles."""
@@ -25,47 +77,105 @@ class MixpanelQuery(object):
 
     ENDPOINT = "https://mixpanel.com/api/2.0/jql"
 
+    # (connect, read) timeouts in seconds
+    TIMEOUT = (3, 120)
+
+    # How many profile_by_email results to keep and for how many seconds
+    PROFILE_CACHE_SIZE = 1024
+    PROFILE_CACHE_TTL = 60.0
+
     def __init__(self, settings: t.Dict[str, str]) -> None:
         """Save API credentials."""
         self.api_secret = settings["mixpanel.api_secret"]
 
-    def jql(self, jql: str) -> t.List[t.Dict]:
+    @property
+    def session(self) -> requests.Session:
+        """Return this thread's Session, shared by all instances."""
+        return _get_session()
+
+    @classmethod
+    def profile_by_email_cache_clear(cls) -> None:
+        """Forget all cached profile_by_email results."""
+        with _PROFILE_CACHE_LOCK:
+            _PROFILE_CACHE.clear()
+
+    def jql(self, jql: str, params: t.Optional[t.Dict] = None) -> t.List[t.Dict]:
         """Query Mixpanel using JQL script.
 
+        Values in `params` are available in the script as the global `params`
+        object, so there is no need to escape them into the script yourself.
+
         You can troubleshoot the script on
         https://mixpanel.com/report/<PROJECT_ID>/jql-console.
         """
-        resp = requests.post(
-            self.ENDPOINT, auth=(self.api_secret, ""), data={"script": jql}
+        data = {"script": jql}
+        if params is not None:
+            data["params"] = json.dumps(params)
+
+        resp = self.session.post(
+            self.ENDPOINT,
+            auth=(self.api_secret, ""),
+            data=data,
+            timeout=self.TIMEOUT,
         )
         resp.raise_for_status()
-        return resp.json()
+        # Mixpanel responds with UTF-8 JSON, skip requests' encoding detection
+        return json_loads(resp.content)
 
     #################################################
     #         ---- Pre-built queries ----           #
     # A couple of queries that we use all the time. #
     #################################################
 
+    PROFILE_BY_EMAIL_JQL = """
+        function main() {
+          return People(
+          )
+          .filter(function(profile) {
+            return profile.properties.$email == params.email;
+          })
+          .map(function(profile) {
+            return {
+              distinct_id: profile.distinct_id,
+              email: profile.properties.$email,
+            };
+          });
+        }
+    """
+
     def profile_by_email(self, email: str):
-        """Return a Mixpanel profile by given email."""
-        profiles = self.jql(
-            """
-            function main() {
-              return People(
-              )
-              .filter(function(profile) {
-                return profile.properties.$email == '%(email)s';
-              })
-              .map(function(profile) {
-                return {
-                  distinct_id: profile.distinct_id,
-                  email: profile.properties.$email,
-                };
-              });
-            }
+        """Return a Mixpanel profile by given email.
+
+        Found profiles are cached for PROFILE_CACHE_TTL seconds. Misses are not,
+        because the profile might be created any moment, for example right
+        after sign up. Errors are not cached either.
         """
-            % {"email": email}
-        )
+        key = (self.api_secret, email)
+        with _PROFILE_CACHE_LOCK:
+            cached = _PROFILE_CACHE.get(key)
+            if cached and cached[0] > time.monotonic():
+                _PROFILE_CACHE.move_to_end(key)
+                return dict(cached[1])
+
+        profile = self._profile_by_email(email)
+        if profile is None:
+            return None
+
+        with _PROFILE_CACHE_LOCK:
+            _PROFILE_CACHE[key] = (
+                time.monotonic() + self.PROFILE_CACHE_TTL,
+                profile,
+            )
+            _PROFILE_CACHE.move_to_end(key)
+            while len(_PROFILE_CACHE) > self.PROFILE_CACHE_SIZE:
+                _PROFILE_CACHE.popitem(last=False)
+
+        # a copy, so that callers cannot change what is cached
+        return dict(profile)
+
+    def _profile_by_email(self, email: str) -> t.Optional[t.Dict]:
+        """Query Mixpanel for a profile by given email."""
+        profiles = self.jql(self.PROFILE_BY_EMAIL_JQL, params={"email": email})
 
         if len(profiles) == 0:
             return None
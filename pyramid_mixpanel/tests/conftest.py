@@ -0,0 +1,13 @@
+"""Shared test fixtures."""
+
+import pytest
+import structlog
+
+
+@pytest.fixture(autouse=True, scope="session")
+def structlog_to_stdlib() -> None:
+    """Render structlog messages through stdlib logging, for LogCapture."""
+    structlog.configure(
+        processors=[structlog.processors.KeyValueRenderer(sort_keys=True)],
+        logger_factory=structlog.stdlib.LoggerFactory(),
+    )
@@ -2,11 +2,15 @@
 
 from pyramid_mixpanel.consumer import MockedConsumer
 from pyramid_mixpanel.consumer import PoliteBufferedConsumer
+from pyramid_mixpanel.consumer import QueuedConsumer
 from testfixtures import LogCapture
 from unittest import mock
 from urllib.error import URLError
 
-import structlog
+import json
+import math
+import queue
+import threading
 
 
 def test_MockedConsumer() -> None:
@@ -25,6 +29,34 @@ def test_MockedConsumer() -> None:
     assert consumer.flushed is True
 
 
+def test_MockedConsumer_nan() -> None:
+    """Test that MockedConsumer parses NaN and Infinity, like Mixpanel does."""
+    json_message = '{"foo": NaN, "bar": Infinity}'
+
+    consumer = MockedConsumer()
+    consumer.send(endpoint="events", json_message=json_message)
+    msg = consumer.mocked_messages[0]["msg"]
+    assert math.isnan(msg["foo"])
+    assert msg["bar"] == math.inf
+
+    # same without orjson
+    with mock.patch("pyramid_mixpanel.consumer.orjson", None):
+        consumer = MockedConsumer()
+        consumer.send(endpoint="events", json_message=json_message)
+    msg = consumer.mocked_messages[0]["msg"]
+    assert math.isnan(msg["foo"])
+    assert msg["bar"] == math.inf
+
+
+def test_MockedConsumer_skip_storing() -> None:
+    """Test that MockedConsumer can be told not to store messages."""
+    with mock.patch.object(MockedConsumer, "STORE_MESSAGES", False):
+        consumer = MockedConsumer()
+        consumer.send(endpoint="events", json_message='{"foo":"Foo"}')
+
+    assert consumer.mocked_messages == []
+
+
 def test_MockedConsumer_drop_system_properties() -> None:
     """Test that MockedConsumer saves messages."""
     PEOPLE_RAW = '{"$token": "testing", "$time": 1546300800, "$distinct_id": "foo-123", "$set": {"$name": "Bob"}}'  # noqa: E501
@@ -94,11 +126,6 @@ def test_MockedConsumer_drop_system_properties() -> None:
 @mock.patch("mixpanel.BufferedConsumer.flush")
 def test_PoliteBufferedConsumer(flush: mock.MagicMock) -> None:
     """Test that PoliteBufferedConsumer logs errors and continues."""
-    structlog.configure(
-        processors=[structlog.processors.KeyValueRenderer(sort_keys=True)],
-        logger_factory=structlog.stdlib.LoggerFactory(),
-    )
-
     consumer = PoliteBufferedConsumer(use_structlog=True)
 
     consumer.send(endpoint="events", json_message='{"foo":"Foo"}')
@@ -134,3 +161,250 @@ def test_PoliteBufferedConsumer(flush: mock.MagicMock) -> None:
     logs.check(
         ("pyramid_mixpanel.consumer", "ERROR", "It seems like Mixpanel is down.")
     )
+
+
+def test_PoliteBufferedConsumer_shared_connections() -> None:
+    """Test that PoliteBufferedConsumers share connections but not buffers."""
+    one = PoliteBufferedConsumer()
+    two = PoliteBufferedConsumer()
+    assert one._consumer is two._consumer  # noqa: SF01
+    assert one._buffers is not two._buffers  # noqa: SF01
+
+    other = PoliteBufferedConsumer(request_timeout=5)
+    assert other._consumer is not one._consumer  # noqa: SF01
+
+    # requests.Session is not thread-safe, so threads do not share them
+    consumers = []
+    thread = threading.Thread(
+        target=lambda: consumers.append(PoliteBufferedConsumer()._consumer)
+    )
+    thread.start()
+    thread.join()
+    assert consumers[0] is not one._consumer  # noqa: SF01
+
+
+def test_PoliteBufferedConsumer_init() -> None:
+    """Test that PoliteBufferedConsumer is set up like BufferedConsumer."""
+    from mixpanel import BufferedConsumer
+
+    consumer = PoliteBufferedConsumer(False, 10, "https://example.com/track")
+    assert vars(BufferedConsumer()).keys() <= vars(consumer).keys()
+    assert consumer._max_size == 10  # noqa: SF01
+    assert (
+        consumer._consumer._endpoints["events"]  # noqa: SF01
+        == "https://example.com/track"
+    )
+
+    assert PoliteBufferedConsumer(max_size=100)._max_size == 50  # noqa: SF01
+
+
+@mock.patch("pyramid_mixpanel.consumer.time.monotonic")
+@mock.patch("mixpanel.BufferedConsumer.flush")
+def test_PoliteBufferedConsumer_flush_interval(
+    flush: mock.MagicMock, monotonic: mock.MagicMock
+) -> None:
+    """Test that PoliteBufferedConsumer flushes messages that are buffered too long."""
+    consumer = PoliteBufferedConsumer(flush_interval=1.0)
+
+    monotonic.return_value = 100.0
+    consumer.send(endpoint="events", json_message='{"foo":"Foo"}')
+    monotonic.return_value = 100.5
+    consumer.send(endpoint="people", json_message='{"bar":"Bar"}')
+    flush.assert_not_called()
+
+    monotonic.return_value = 101.5
+    consumer.send(endpoint="events", json_message='{"baz":"Baz"}')
+    flush.assert_called_once_with()
+
+    # the interval starts ticking again with the next buffered message
+    flush.reset_mock()
+    monotonic.return_value = 102.0
+    consumer.send(endpoint="events", json_message='{"foo":"Foo"}')
+    flush.assert_not_called()
+
+    # disabled by default
+    consumer = PoliteBufferedConsumer()
+    monotonic.return_value = 200.0
+    consumer.send(endpoint="events", json_message='{"foo":"Foo"}')
+    monotonic.return_value = 300.0
+    consumer.send(endpoint="events", json_message='{"bar":"Bar"}')
+    flush.assert_not_called()
+
+
+@mock.patch("mixpanel.Consumer.send")
+def test_QueuedConsumer(send: mock.MagicMock) -> None:
+    """Test that QueuedConsumer sends messages from a background thread."""
+    from pyramid_mixpanel.consumer import _stop_worker
+
+    consumer = QueuedConsumer()
+    # only the background thread talks to Mixpanel
+    assert not hasattr(consumer, "_consumer")
+
+    consumer.send(endpoint="events", json_message='{"foo":"Foo"}')
+    consumer.send(endpoint="events", json_message='{"bar":"Bar"}')
+    consumer.send(endpoint="people", json_message='{"baz":"Baz"}')
+
+    # flushing is left to the background thread
+    consumer.flush()
+
+    _stop_worker()
+    send.assert_has_calls(
+        [
+            mock.call("events", '[{"foo":"Foo"},{"bar":"Bar"}]', api_key=(None, None)),
+            mock.call("people", '[{"baz":"Baz"}]', api_key=(None, None)),
+        ]
+    )
+
+    # stopping an already stopped worker is a no-op
+    _stop_worker()
+
+
+@mock.patch("mixpanel.Consumer.send")
+def test_QueuedConsumer_idle_flush(send: mock.MagicMock) -> None:
+    """Test that the background thread flushes when the queue is idle."""
+    from pyramid_mixpanel.consumer import _stop_worker
+
+    sent = threading.Event()
+    send.side_effect = lambda *args, **kwargs: sent.set()
+
+    consumer = QueuedConsumer()
+    consumer.send(endpoint="events", json_message='{"foo":"Foo"}')
+
+    assert sent.wait(timeout=5)
+    send.assert_called_once_with("events", '[{"foo":"Foo"}]', api_key=(None, None))
+
+    _stop_worker()
+
+
+@mock.patch("mixpanel.Consumer.send")
+def test_QueuedConsumer_import_data(send: mock.MagicMock) -> None:
+    """Test that imports are sent with their credentials, one by one."""
+    from mixpanel import Mixpanel
+    from pyramid_mixpanel.consumer import _stop_worker
+
+    mixpanel = Mixpanel("token", consumer=QueuedConsumer())
+    mixpanel.track("foo", "Foo")
+    mixpanel.import_data("key", "foo", "Imported", 1600000000, api_secret="secret")
+    mixpanel.import_data("other", "foo", "Imported", 1600000000, api_secret="psst")
+
+    _stop_worker()
+    assert [call.args[0] for call in send.call_args_list] == [
+        "imports",
+        "imports",
+        "events",
+    ]
+    assert send.call_args_list[0].kwargs == {
+        "api_key": ("key", "secret"),
+        "api_secret": None,
+    }
+    assert send.call_args_list[1].kwargs == {
+        "api_key": ("other", "psst"),
+        "api_secret": None,
+    }
+    assert json.loads(send.call_args_list[0].args[1])["event"] == "Imported"
+    assert send.call_args_list[2].kwargs == {"api_key": (None, None)}
+
+
+@mock.patch("pyramid_mixpanel.consumer._start_worker", mock.Mock())
+@mock.patch("pyramid_mixpanel.consumer._QUEUE", queue.Queue(maxsize=1))
+def test_QueuedConsumer_queue_full() -> None:
+    """Test that QueuedConsumer drops messages when the queue is full."""
+    consumer = QueuedConsumer()
+
+    with LogCapture() as logs:
+        consumer.send(endpoint="events", json_message='{"foo":"Foo"}')
+        consumer.send(endpoint="events", json_message='{"bar":"Bar"}')
+
+    logs.check(
+        (
+            "pyramid_mixpanel.consumer",
+            "WARNING",
+            "Mixpanel queue is full, dropping message.",
+        )
+    )
+
+
+@mock.patch("mixpanel.Consumer.send")
+def test_QueuedConsumer_errors(send: mock.MagicMock) -> None:
+    """Test that the background thread drops batches that Mixpanel rejects."""
+    from mixpanel import MixpanelException
+    from pyramid_mixpanel.consumer import _stop_worker
+
+    send.side_effect = MixpanelException("foo")
+    consumer = QueuedConsumer(use_structlog=True)
+
+    with LogCapture() as logs:
+        for i in range(120):
+            consumer.send(endpoint="events", json_message=f'{{"foo":{i}}}')
+        _stop_worker()
+
+    # every message was tried once, in batches of at most 50, and dropped
+    batches = [json.loads(call.args[1]) for call in send.call_args_list]
+    assert max(len(batch) for batch in batches) <= 50
+    assert [msg for batch in batches for msg in batch] == [
+        {"foo": i} for i in range(120)
+    ]
+
+    assert set(logs.actual()) == {
+        (
+            "pyramid_mixpanel.consumer",
+            "ERROR",
+            "event='Failed sending messages to Mixpanel, dropping them.' "
+            "exc_info=True",
+        )
+    }
+
+
+@mock.patch("mixpanel.Consumer.send")
+def test_QueuedConsumer_errors_recover(send: mock.MagicMock) -> None:
+    """Test that messages queued after a rejected batch are still sent."""
+    from mixpanel import MixpanelException
+    from pyramid_mixpanel.consumer import _stop_worker
+
+    rejected = threading.Event()
+
+    def reject_first(*args, **kwargs) -> None:
+        """Reject only the first batch."""
+        if not rejected.is_set():
+            rejected.set()
+            raise MixpanelException("foo")
+
+    send.side_effect = reject_first
+    consumer = QueuedConsumer()
+
+    with LogCapture() as logs:
+        consumer.send(endpoint="events", json_message='{"foo":"Foo"}')
+        assert rejected.wait(timeout=5)
+        consumer.send(endpoint="events", json_message='{"bar":"Bar"}')
+        # unknown endpoints do not stop the thread either
+        consumer.send(endpoint="baz", json_message='{"baz":"Baz"}')
+        _stop_worker()
+
+    assert send.call_args_list == [
+        mock.call("events", '[{"foo":"Foo"}]', api_key=(None, None)),
+        mock.call("events", '[{"bar":"Bar"}]', api_key=(None, None)),
+    ]
+    logs.check(
+        (
+            "pyramid_mixpanel.consumer",
+            "ERROR",
+            "Failed sending messages to Mixpanel, dropping them.",
+        ),
+        (
+            "pyramid_mixpanel.consumer",
+            "ERROR",
+            "Failed sending messages to Mixpanel.",
+        ),
+    )
+
+
+@mock.patch("pyramid_mixpanel.consumer._QUEUE", queue.Queue(maxsize=1))
+def test_stop_worker_queue_full() -> None:
+    """Test that a background thread that is behind does not block exit."""
+    from pyramid_mixpanel import consumer
+
+    consumer._QUEUE.put(("events", '{"foo":"Foo"}', None, None))  # noqa: SF01
+    with mock.patch.object(consumer, "_WORKER") as worker:
+        consumer._stop_worker(timeout=0.01)  # noqa: SF01
+
+    worker.join.assert_not_called()
@@ -1,30 +1,36 @@
 """Functional tests against a real Pyramid app."""
 
-from freezegun import freeze_time
 from mixpanel import json_dumps
 from pyramid.config import Configurator
 from pyramid.request import Request
 from pyramid.router import Router
-from pyramid.view import view_config
 from pyramid_mixpanel import EventProperties
 from pyramid_mixpanel import Events
 from pyramid_mixpanel import ProfileProperties
+from responses.matchers import urlencoded_params_matcher
 from testfixtures import LogCapture
 from unittest import mock
 from webtest import TestApp
 
+import pytest
 import responses
-import structlog
+import types
 import typing as t
-import urllib
+
+# mocking that request has a user object
+USER = types.SimpleNamespace(distinct_id="foo-123")
+
+# Messages that the hello view stores in MockedConsumer
+HELLO_PROFILE_MESSAGE = {
+    "endpoint": "people",
+    "msg": {"$distinct_id": "foo-123", "$set": {"$name": "Bob"}},
+}
+HELLO_EVENT_PROPERTIES = {"distinct_id": "foo-123", "Path": "/hello"}
 
 
-@view_config(route_name="hello", renderer="json", request_method="GET")
 def hello(request: Request) -> t.Dict[str, str]:
     """Say hello."""
-    # mocking that request has a user object
-    request.user = mock.MagicMock(spec="distinct_id".split())
-    request.user.distinct_id = "foo-123"
+    request.user = USER
 
     # provide access to Pyramid request in WebTest response
     request.environ["paste.testing_variables"]["app_request"] = request
@@ -34,23 +40,24 @@ def hello(request: Request) -> t.Dict[str, str]:
     return {"hello": "world"}
 
 
-@view_config(route_name="bye", renderer="json", request_method="GET")
 def bye(request: Request) -> t.Dict[str, str]:
     """Say bye."""
     return {"bye": "bye"}
 
 
+def anonymous(request: Request) -> t.Dict[str, str]:
+    """Use request.mixpanel, but do not send anything."""
+    return {"distinct_id": request.mixpanel.distinct_id}
+
+
 def app(settings) -> Router:
     """Create a dummy Pyramid app."""
-    structlog.configure(
-        processors=[structlog.processors.KeyValueRenderer(sort_keys=True)],
-        logger_factory=structlog.stdlib.LoggerFactory(),
-    )
-
     with Configurator() as config:
-        config.add_route("hello", "/hello")
-        config.add_route("bye", "/bye")
-        config.scan(".")
+        for view in (hello, bye, anonymous):
+            config.add_route(view.__name__, f"/{view.__name__}")
+            config.add_view(
+                view, route_name=view.__name__, renderer="json", request_method="GET"
+            )
 
         config.registry.settings.update(**settings)
         config.include("pyramid_mixpanel")
@@ -90,41 +97,85 @@ def test_MockedConsumer(_make_insert_id) -> None:
 
     assert res.app_request.mixpanel.api._consumer.flushed is True
     assert res.app_request.mixpanel.api._consumer.mocked_messages == [
-        {
-            "endpoint": "people",
-            "msg": {"$distinct_id": "foo-123", "$set": {"$name": "Bob"}},
-        },
+        HELLO_PROFILE_MESSAGE,
         {
             "endpoint": "events",
-            "msg": {
-                "event": "Page Viewed",
-                "properties": {"distinct_id": "foo-123", "Path": "/hello"},
-            },
+            "msg": {"event": "Page Viewed", "properties": HELLO_EVENT_PROPERTIES},
         },
     ]
 
+    # regular logging if structlog is not enabled
+    with LogCapture() as logs:
+        TestApp(app({"pyramid_heroku.structlog": False}))
+
+    logs.check(
+        (
+            "pyramid_mixpanel",
+            "INFO",
+            "Mixpanel configured consumer=MockedConsumer, events=Events, "
+            "event_properties=EventProperties, "
+            "profile_properties=ProfileProperties, "
+            "profile_meta_properties=ProfileMetaProperties, customerio=False",
+        ),
+        (
+            "pyramid_mixpanel",
+            "WARNING",
+            "Mixpanel is in testing mode, no message will be sent!",
+        ),
+    )
+
 
-@freeze_time("2019-01-01")
 @responses.activate
+@mock.patch("mixpanel.Mixpanel._now")
 @mock.patch("mixpanel.Mixpanel._make_insert_id")
-def test_PoliteBufferedConsumer(_make_insert_id) -> None:
+def test_PoliteBufferedConsumer(_make_insert_id, _now) -> None:
     """Test that request.mixpanel works as expected with PoliteBufferedConsumer.
 
     And with Customer.io as well.
     """
     _make_insert_id.return_value = "123e4567"
+    _now.return_value = 1546300800  # 2019-01-01
+
+    event = {
+        "event": "Page Viewed",
+        "properties": {
+            "token": "SECRET",
+            "distinct_id": "foo-123",
+            "time": 1546300800,
+            "$insert_id": "123e4567",
+            "mp_lib": "python",
+            "$lib_version": "4.9.0",
+            "Path": "/hello",
+        },
+    }
+    profile = {
+        "$token": "SECRET",
+        "$time": 1546300800,
+        "$distinct_id": "foo-123",
+        "$set": {"$name": "Bob"},
+    }
 
     responses.add(
         responses.POST,
         "https://api.mixpanel.com/engage",
         json={"error": None, "status": 1},
         status=200,
+        match=[
+            urlencoded_params_matcher(
+                {"data": json_dumps([profile]), "verbose": "1", "ip": "0"}
+            )
+        ],
     )
     responses.add(
         responses.POST,
         "https://api.mixpanel.com/track",
         json={"error": None, "status": 1},
         status=200,
+        match=[
+            urlencoded_params_matcher(
+                {"data": json_dumps([event]), "verbose": "1", "ip": "0"}
+            )
+        ],
     )
     responses.add(
         responses.PUT,
@@ -150,184 +201,106 @@ def test_PoliteBufferedConsumer(_make_insert_id) -> None:
         res = testapp.get("/hello", status=200)
         assert res.json == {"hello": "world"}
 
-    logs.check(
-        (
-            "pyramid_mixpanel",
-            "INFO",
-            "consumer='PoliteBufferedConsumer' customerio=True event='Mixpanel "
-            "configured' event_properties='EventProperties' events='Events' "
-            "profile_meta_properties='ProfileMetaProperties' "
-            "profile_properties='ProfileProperties'",
-        ),
-    )
-
-    assert len(responses.calls) == 4
+        logs.check(
+            (
+                "pyramid_mixpanel",
+                "INFO",
+                "consumer='PoliteBufferedConsumer' customerio=True event='Mixpanel "
+                "configured' event_properties='EventProperties' events='Events' "
+                "profile_meta_properties='ProfileMetaProperties' "
+                "profile_properties='ProfileProperties'",
+            ),
+        )
 
-    # Customer.io requests are first because they are not buffered
-    assert (
-        responses.calls[0].request.url
-        == "https://track-eu.customer.io/api/v1/customers/foo-123"
-    )
-    assert responses.calls[0].request.body == b'{"name": "Bob"}'
-    assert (
-        responses.calls[1].request.url
-        == "https://track-eu.customer.io/api/v1/customers/foo-123/events"
-    )
-    assert (
-        responses.calls[1].request.body
-        == b'{"name": "Page Viewed", "data": {"Path": "/hello"}}'
-    )
+        assert len(responses.calls) == 4
 
-    # Then comes Mixpanel request
-    assert responses.calls[2].request.url == "https://api.mixpanel.com/track"
-    event = {
-        "event": "Page Viewed",
-        "properties": {
-            "token": "SECRET",
-            "distinct_id": "foo-123",
-            "time": 1546300800,
-            "$insert_id": "123e4567",
-            "mp_lib": "python",
-            "$lib_version": "4.9.0",
-            "Path": "/hello",
-        },
-    }
-    json_message = json_dumps([event])
-    params = {"data": json_message, "verbose": 1, "ip": 0}
-    assert responses.calls[2].request.body == urllib.parse.urlencode(params)
+        # Customer.io requests are first because they are not buffered
+        assert (
+            responses.calls[0].request.url
+            == "https://track-eu.customer.io/api/v1/customers/foo-123"
+        )
+        assert responses.calls[0].request.body == b'{"name": "Bob"}'
+        assert (
+            responses.calls[1].request.url
+            == "https://track-eu.customer.io/api/v1/customers/foo-123/events"
+        )
+        assert (
+            responses.calls[1].request.body
+            == b'{"name": "Page Viewed", "data": {"Path": "/hello"}}'
+        )
 
-    assert responses.calls[3].request.url == "https://api.mixpanel.com/engage"
-    event = {
-        "$token": "SECRET",
-        "$time": 1546300800,  # type: ignore
-        "$distinct_id": "foo-123",
-        "$set": {"$name": "Bob"},
-    }
-    json_message = json_dumps([event])
-    params = {"data": json_message, "verbose": 1, "ip": 0}
-    assert responses.calls[3].request.body == urllib.parse.urlencode(params)
+        # Then come Mixpanel requests, their bodies are checked by the matchers
+        assert responses.calls[2].request.url == "https://api.mixpanel.com/track"
+        assert responses.calls[3].request.url == "https://api.mixpanel.com/engage"
 
-    # regular logging if structlog is not enabled
-    with LogCapture() as logs:
+        # regular logging if structlog is not enabled
+        logs.clear()
         settings = {"mixpanel.token": "SECRET", "pyramid_heroku.structlog": False}
         testapp = TestApp(app(settings))
 
         res = testapp.get("/hello", status=200)
         assert res.json == {"hello": "world"}
 
-    logs.check(
-        (
-            "pyramid_mixpanel",
-            "INFO",
-            "Mixpanel configured consumer=PoliteBufferedConsumer, events=Events, "
-            "event_properties=EventProperties, profile_properties=ProfileProperties, "
-            "profile_meta_properties=ProfileMetaProperties, customerio=False",
-        ),
-    )
-
+        logs.check(
+            (
+                "pyramid_mixpanel",
+                "INFO",
+                "Mixpanel configured consumer=PoliteBufferedConsumer, events=Events, "
+                "event_properties=EventProperties, "
+                "profile_properties=ProfileProperties, "
+                "profile_meta_properties=ProfileMetaProperties, customerio=False",
+            ),
+        )
 
-@mock.patch("mixpanel.Mixpanel._make_insert_id")
-def test_header_event_props(_make_insert_id) -> None:
-    """Test that event properties from header are added to the event."""
-    _make_insert_id.return_value = "123e4567"
 
-    with LogCapture() as logs:
-        testapp = TestApp(app({"pyramid_heroku.structlog": True}))
+@pytest.fixture(scope="module")
+def mocked_app(request: pytest.FixtureRequest) -> TestApp:
+    """Create an app with MockedConsumer once per module and logging backend."""
+    return TestApp(app({"pyramid_heroku.structlog": request.param}))
 
-        res = testapp.get(
-            "/hello",
-            headers={"X-Mixpanel-Title": "hello", "X-Mixpanel-Foo": "bar"},
-            status=200,
-        )
-        assert res.json == {"hello": "world"}
 
-    logs.check(
+@pytest.mark.parametrize(
+    "mocked_app, warning",
+    [
         (
-            "pyramid_mixpanel",
-            "INFO",
-            "consumer='MockedConsumer' customerio=False event='Mixpanel configured' "
-            "event_properties='EventProperties' events='Events' "
-            "profile_meta_properties='ProfileMetaProperties' "
-            "profile_properties='ProfileProperties'",
-        ),
-        (
-            "pyramid_mixpanel",
-            "WARNING",
-            "event='Mixpanel is in testing mode, no message will be sent!'",
-        ),
-        (
-            "pyramid_mixpanel.track",
-            "WARNING",
+            True,
             "event=\"Property 'foo', from request header 'X-Mixpanel-Foo' is not a "
             'member of event_properties"',
         ),
-    )
-
-    assert res.app_request.mixpanel.api._consumer.flushed is True
-
-    assert res.app_request.mixpanel.api._consumer.mocked_messages == [
-        {
-            "endpoint": "people",
-            "msg": {"$distinct_id": "foo-123", "$set": {"$name": "Bob"}},
-        },
-        {
-            "endpoint": "events",
-            "msg": {
-                "event": "Page Viewed",
-                "properties": {
-                    "distinct_id": "foo-123",
-                    "Title": "hello",
-                    "Path": "/hello",
-                },
-            },
-        },
-    ]
+        (
+            False,
+            "Property 'foo', from request header 'X-Mixpanel-Foo' is not a member of "
+            "event_properties",
+        ),
+    ],
+    indirect=["mocked_app"],
+    ids=["structlog", "logging"],
+)
+@mock.patch("mixpanel.Mixpanel._make_insert_id")
+def test_header_event_props(
+    _make_insert_id: mock.MagicMock, mocked_app: TestApp, warning: str
+) -> None:
+    """Test that event properties from header are added to the event."""
+    _make_insert_id.return_value = "123e4567"
 
     with LogCapture() as logs:
-        testapp = TestApp(app({}))
-
-        res = testapp.get(
+        res = mocked_app.get(
             "/hello",
             headers={"X-Mixpanel-Title": "hello", "X-Mixpanel-Foo": "bar"},
             status=200,
         )
         assert res.json == {"hello": "world"}
 
-    logs.check(
-        (
-            "pyramid_mixpanel",
-            "INFO",
-            "Mixpanel configured consumer=MockedConsumer, events=Events, "
-            "event_properties=EventProperties, profile_properties=ProfileProperties, "
-            "profile_meta_properties=ProfileMetaProperties, customerio=False",
-        ),
-        (
-            "pyramid_mixpanel",
-            "WARNING",
-            "Mixpanel is in testing mode, no message will be sent!",
-        ),
-        (
-            "pyramid_mixpanel.track",
-            "WARNING",
-            "Property 'foo', from request header 'X-Mixpanel-Foo' is not a member of "
-            "event_properties",
-        ),
-    )
+    logs.check(("pyramid_mixpanel.track", "WARNING", warning))
+
     assert res.app_request.mixpanel.api._consumer.flushed is True
     assert res.app_request.mixpanel.api._consumer.mocked_messages == [
-        {
-            "endpoint": "people",
-            "msg": {"$distinct_id": "foo-123", "$set": {"$name": "Bob"}},
-        },
+        HELLO_PROFILE_MESSAGE,
         {
             "endpoint": "events",
             "msg": {
                 "event": "Page Viewed",
-                "properties": {
-                    "distinct_id": "foo-123",
-                    "Title": "hello",
-                    "Path": "/hello",
-                },
+                "properties": {**HELLO_EVENT_PROPERTIES, "Title": "hello"},
             },
         },
     ]
@@ -355,3 +328,15 @@ def test_request_mixpanel_not_used(flush: mock.MagicMock) -> None:
         ),
     )
     flush.assert_not_called()
+
+
+@mock.patch("pyramid_mixpanel.consumer.PoliteBufferedConsumer.flush")
+def test_request_mixpanel_api_not_used(flush: mock.MagicMock) -> None:
+    """Test that flush() is not called if nothing was sent to Mixpanel."""
+    settings = {"mixpanel.token": "SECRET"}
+    testapp = TestApp(app(settings))
+
+    res = testapp.get("/anonymous", status=200)
+    assert res.json == {"distinct_id": None}
+
+    flush.assert_not_called()
@@ -1,25 +1,58 @@
 """Tests for querying data from Mixpanel."""
 
 from pyramid_mixpanel.query import MixpanelQuery
+from unittest import mock
 
 import pytest
 import responses
+import threading
+import typing as t
 
 SETTINGS = {"mixpanel.api_secret": "bar"}
 
 
-@responses.activate
-def test_zero_results() -> None:
+@pytest.fixture(autouse=True, scope="module")
+def mocked_responses() -> t.Iterator[None]:
+    """Intercept HTTP requests for all tests in this module."""
+    responses.start()
+    yield
+    responses.stop()
+    responses.reset()
+
+
+@pytest.fixture(autouse=True)
+def reset_responses() -> t.Iterator[None]:
+    """Forget registered responses and calls after every test."""
+    yield
+    responses.reset()
+
+
+@pytest.fixture(autouse=True)
+def profile_cache() -> None:
+    """Start every test with an empty profile_by_email cache."""
+    MixpanelQuery.profile_by_email_cache_clear()
+
+
+@pytest.fixture(scope="module")
+def query() -> MixpanelQuery:
+    """Share one MixpanelQuery between tests, it holds no per-test state."""
+    return MixpanelQuery(SETTINGS)
+
+
+def test_zero_results(query: MixpanelQuery) -> None:
     """Return None if no profiles found."""
     responses.add(
         responses.POST, "https://mixpanel.com/api/2.0/jql", json=[], status=200
     )
 
-    assert MixpanelQuery(SETTINGS).profile_by_email("foo") is None
+    assert query.profile_by_email("foo") is None
+
+    # misses are not cached, the profile might be created in the meantime
+    assert query.profile_by_email("foo") is None
+    assert len(responses.calls) == 2
 
 
-@responses.activate
-def test_too_many_results() -> None:
+def test_too_many_results(query: MixpanelQuery) -> None:
     """Raise exception if more than one profiles found."""
     from pyramid_mixpanel.query import MultipleProfilesFoundException
 
@@ -34,7 +67,7 @@ def test_too_many_results() -> None:
     )
 
     with pytest.raises(MultipleProfilesFoundException) as cm:
-        MixpanelQuery(SETTINGS).profile_by_email("foo@bar.com")
+        query.profile_by_email("foo@bar.com")
 
     assert (
         str(cm.value)
@@ -42,8 +75,7 @@ def test_too_many_results() -> None:
     )
 
 
-@responses.activate
-def test_profile_by_email() -> None:
+def test_profile_by_email(query: MixpanelQuery) -> None:
     """Test happy path."""
     responses.add(
         responses.POST,
@@ -52,7 +84,111 @@ def test_profile_by_email() -> None:
         status=200,
     )
 
-    assert MixpanelQuery(SETTINGS).profile_by_email("foo@bar.com") == {
+    assert query.profile_by_email("foo@bar.com") == {
         "distinct_id": "foo",
         "email": "foo@bar.com",
     }
+
+
+def test_session() -> None:
+    """Connections to Mixpanel are pooled and retried across instances."""
+    session = MixpanelQuery(SETTINGS).session
+
+    assert session is MixpanelQuery(SETTINGS).session
+
+    # requests.Session is not thread-safe, so threads do not share them
+    sessions = []
+    thread = threading.Thread(
+        target=lambda: sessions.append(MixpanelQuery(SETTINGS).session)
+    )
+    thread.start()
+    thread.join()
+    assert sessions[0] is not session
+
+    adapter = session.get_adapter("https://mixpanel.com")
+    assert adapter.max_retries.total == 3  # type: ignore
+    assert 429 in adapter.max_retries.status_forcelist  # type: ignore
+    assert adapter.max_retries.respect_retry_after_header is False  # type: ignore
+    assert adapter.max_retries.raise_on_status is False  # type: ignore
+
+
+def test_http_error(query: MixpanelQuery) -> None:
+    """Errors are raised as HTTPError.
+
+    responses replaces HTTPAdapter.send, so Retry does not run here. That
+    retries end with the last response, and not RetryError, is down to
+    raise_on_status, checked in test_session.
+    """
+    from requests import HTTPError
+
+    responses.add(responses.POST, "https://mixpanel.com/api/2.0/jql", status=503)
+
+    with pytest.raises(HTTPError):
+        query.jql("function main() {}")
+
+
+@mock.patch("pyramid_mixpanel.query.time.monotonic")
+def test_profile_by_email_cache(monotonic: mock.MagicMock) -> None:
+    """Repeated lookups are served from cache until they expire."""
+    responses.add(
+        responses.POST,
+        "https://mixpanel.com/api/2.0/jql",
+        json=[{"distinct_id": "foo", "email": "foo@bar.com"}],
+        status=200,
+    )
+    monotonic.return_value = 100.0
+
+    query = MixpanelQuery(SETTINGS)
+    profile = {"distinct_id": "foo", "email": "foo@bar.com"}
+    assert query.profile_by_email("foo@bar.com") == profile
+    assert query.profile_by_email("foo@bar.com") == profile
+    assert MixpanelQuery(SETTINGS).profile_by_email("foo@bar.com") == profile
+    assert len(responses.calls) == 1
+
+    # expired
+    monotonic.return_value = 200.0
+    assert query.profile_by_email("foo@bar.com") == profile
+    assert len(responses.calls) == 2
+
+    # changing the returned profile does not change the cached one
+    query.profile_by_email("foo@bar.com")["email"] = "bar@bar.com"
+    assert query.profile_by_email("foo@bar.com") == profile
+    assert len(responses.calls) == 2
+
+    # least recently used profiles are evicted
+    with mock.patch.object(MixpanelQuery, "PROFILE_CACHE_SIZE", 1):
+        query.profile_by_email("bar@bar.com")
+        query.profile_by_email("foo@bar.com")
+    assert len(responses.calls) == 4
+
+
+def test_profile_by_email_escaping(query: MixpanelQuery) -> None:
+    """Email is passed as a JQL param instead of being put into the script."""
+    from urllib.parse import parse_qs
+
+    import json
+
+    responses.add(
+        responses.POST, "https://mixpanel.com/api/2.0/jql", json=[], status=200
+    )
+
+    query.profile_by_email("o'neil\"@bar.com")
+
+    body: str = responses.calls[0].request.body  # type: ignore
+    data = parse_qs(body)
+    assert "profile.properties.$email == params.email;" in data["script"][0]
+    assert json.loads(data["params"][0]) == {"email": "o'neil\"@bar.com"}
+
+
+def test_jql_without_params(query: MixpanelQuery) -> None:
+    """Only the script is sent if there are no params."""
+    from urllib.parse import parse_qs
+
+    responses.add(
+        responses.POST, "https://mixpanel.com/api/2.0/jql", json=[1], status=200
+    )
+
+    assert query.jql("function main() {}") == [1]
+
+    body: str = responses.calls[0].request.body  # type: ignore
+    assert parse_qs(body) == {"script": ["function main() {}"]}
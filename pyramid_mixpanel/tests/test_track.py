@@ -1,7 +1,8 @@
 """Tests for Mixpanel tracking."""
 
-from customerio.track import CustomerIO
+from copy import deepcopy
 from dataclasses import dataclass
+from dataclasses import FrozenInstanceError
 from datetime import datetime
 from freezegun import freeze_time
 from mixpanel import Consumer
@@ -14,30 +15,50 @@ from pyramid_mixpanel import Property
 from pyramid_mixpanel.consumer import MockedConsumer
 from pyramid_mixpanel.consumer import PoliteBufferedConsumer
 from pyramid_mixpanel.track import MixpanelTrack
+from pyramid_mixpanel.track import SettingsType
 from unittest import mock
 
+import pickle
 import pytest
+import types
+import typing as t
+
+
+def test_event_and_property() -> None:
+    """Test that Event and Property are slotted, hashable and copyable."""
+    for cls in (Event, Property):
+        item = cls("Foo")
+
+        assert not hasattr(item, "__dict__")
+        assert hash(item) == hash(cls("Foo"))
+        assert deepcopy(item) == item
+        assert pickle.loads(pickle.dumps(item)) == item
+
+        with pytest.raises(FrozenInstanceError):
+            item.name = "Bar"  # type: ignore
 
 
 def test_mixpanel_init_distinct_id() -> None:
     """Test distinct_id is set in mixpanel_init function."""
+    from pyramid_mixpanel.track import mixpanel_flush
     from pyramid_mixpanel.track import mixpanel_init
 
     # Requests without request.user
-    request = mock.Mock(spec="registry headers".split())
-    request.registry.settings = {}
-    request.headers = {}
+    callbacks: t.List[t.Callable] = []
+    request: t.Any = types.SimpleNamespace(
+        registry=types.SimpleNamespace(settings={}),
+        headers={},
+        add_response_callback=callbacks.append,
+    )
 
     result = mixpanel_init(request)
 
     assert result.__class__ == MixpanelTrack
     assert result.distinct_id is None
+    assert callbacks == [mixpanel_flush]
 
     # Requests with request.user
-    request = mock.Mock(spec="registry headers user".split())
-    request.registry.settings = {}
-    request.headers = {}
-    request.user.distinct_id = "foo"
+    request.user = types.SimpleNamespace(distinct_id="foo")
 
     result = mixpanel_init(request)
 
@@ -56,8 +77,9 @@ class BarConsumer(object):
 def test_init_consumers() -> None:
     """Test initialization of Consumer."""
 
-    # default consumer
+    # default consumer, created on first use
     mixpanel = MixpanelTrack(settings={"mixpanel.token": "secret"})
+    assert "api" not in mixpanel.__dict__
     assert isinstance(mixpanel.api._consumer, PoliteBufferedConsumer)  # noqa: SF01
 
     # if token is not set, use MockedConsumer
@@ -104,35 +126,25 @@ class BarEvents:
     bar: Event = Event("Bar")
 
 
-def test_init_events() -> None:
-    """Test initialization of self.events."""
-    # default Events
-    mixpanel = MixpanelTrack(settings={})
-    assert mixpanel.events == Events()
+def test_init_resolves_dotted_names_once() -> None:
+    """Test that dotted-names are resolved and instantiated once per process."""
+    from pyramid_mixpanel.track import _resolve
 
-    # resolved from a dotted-name
-    mixpanel = MixpanelTrack(
-        settings={"mixpanel.events": "pyramid_mixpanel.tests.test_track.FooEvents"}
-    )
-    assert mixpanel.events == FooEvents()
+    _resolve.cache_clear()
+    with mock.patch("pyramid_mixpanel.track.DottedNameResolver") as resolver:
+        resolver.return_value.resolve.return_value = FooEvents
+        settings: SettingsType = {
+            "mixpanel.events": "pyramid_mixpanel.tests.test_track.FooEvents"
+        }
 
-    # the resolved Events need to be based off of pyramid_mixpanel.Events
-    # to contain the events that this library expects
-    with pytest.raises(ValueError) as exc:
-        mixpanel = MixpanelTrack(
-            settings={"mixpanel.events": "pyramid_mixpanel.tests.test_track.BarEvents"}
-        )
-    assert (
-        str(exc.value)
-        == "class in dotted_name needs to be based on pyramid_mixpanel.Events"
-    )
+        events = MixpanelTrack(settings=settings).events
+        assert events == FooEvents()
+        assert MixpanelTrack(settings=settings).events is events
 
-    # passing Events as an object is not (yet) supported
-    with pytest.raises(ValueError) as exc:
-        mixpanel = MixpanelTrack(
-            settings={"mixpanel.events": FooEvents()}  # type: ignore
-        )
-    assert str(exc.value) == "dotted_name must be a string, but it is: FooEvents"
+    resolver.return_value.resolve.assert_called_once_with(
+        "pyramid_mixpanel.tests.test_track.FooEvents"
+    )
+    _resolve.cache_clear()
 
 
 @dataclass(frozen=True)
@@ -145,52 +157,17 @@ class BarEventProperties:
     bar: Property = Property("Bar")
 
 
-def test_init_event_properties() -> None:
-    """Test initialization of self.event_properties."""
-    # default EventProperties
-    mixpanel = MixpanelTrack(settings={})
-    assert mixpanel.event_properties == EventProperties()
-
-    # resolved from a dotted-name
-    mixpanel = MixpanelTrack(
-        settings={
-            "mixpanel.event_properties": "pyramid_mixpanel.tests.test_track.FooEventProperties"
-        }
-    )
-    assert mixpanel.event_properties == FooEventProperties()
-
-    # the resolved EventProperties need to be based off of
-    # pyramid_mixpanel.EventProperties to contain the event properties
-    # that this library expects
-    with pytest.raises(ValueError) as exc:
-        mixpanel = MixpanelTrack(
-            settings={
-                "mixpanel.event_properties": "pyramid_mixpanel.tests.test_track.BarEventProperties"
-            }
-        )
-    assert (
-        str(exc.value)
-        == "class in dotted_name needs to be based on pyramid_mixpanel.EventProperties"
-    )
-
-    # passing EventProperties as an object is not (yet) supported
-    with pytest.raises(ValueError) as exc:
-        mixpanel = MixpanelTrack(
-            settings={"mixpanel.event_properties": FooEventProperties()}  # type: ignore
-        )
-    assert (
-        str(exc.value) == "dotted_name must be a string, but it is: FooEventProperties"
-    )
-
-
 def test_mixpanel_init_customerio() -> None:
     """Test customerio api object is created."""
+    from customerio.track import CustomerIO
     from pyramid_mixpanel.track import mixpanel_init
 
     # By default, Customer.io is not configured
-    request = mock.Mock(spec="registry headers".split())
-    request.registry.settings = {}
-    request.headers = {}
+    request: t.Any = types.SimpleNamespace(
+        registry=types.SimpleNamespace(settings={}),
+        headers={},
+        add_response_callback=lambda callback: None,
+    )
 
     result = mixpanel_init(request)
 
@@ -233,47 +210,6 @@ class BarProfileProperties:
     bar: Property = Property("Bar")
 
 
-def test_init_profile_properties() -> None:
-    """Test initialization of self.profile_properties."""
-    # default ProfileProperties
-    mixpanel = MixpanelTrack(settings={})
-    assert mixpanel.profile_properties == ProfileProperties()
-
-    # resolved from a dotted-name
-    mixpanel = MixpanelTrack(
-        settings={
-            "mixpanel.profile_properties": "pyramid_mixpanel.tests.test_track.FooProfileProperties"
-        }
-    )
-    assert mixpanel.profile_properties == FooProfileProperties()
-
-    # the resolved ProfileProperties need to be based off of
-    # pyramid_mixpanel.ProfileProperties to contain the profile properties
-    # that this library expects
-    with pytest.raises(ValueError) as exc:
-        mixpanel = MixpanelTrack(
-            settings={
-                "mixpanel.profile_properties": "pyramid_mixpanel.tests.test_track.BarProfileProperties"
-            }
-        )
-    assert (
-        str(exc.value)
-        == "class in dotted_name needs to be based on pyramid_mixpanel.ProfileProperties"
-    )
-
-    # passing ProfileProperties as an object is not (yet) supported
-    with pytest.raises(ValueError) as exc:
-        mixpanel = MixpanelTrack(
-            settings={
-                "mixpanel.profile_properties": FooProfileProperties()  # type: ignore
-            }
-        )
-    assert (
-        str(exc.value)
-        == "dotted_name must be a string, but it is: FooProfileProperties"
-    )
-
-
 @dataclass(frozen=True)
 class FooProfileMetaProperties(ProfileMetaProperties):
     foo: Property = Property("Foo")
@@ -284,45 +220,56 @@ class BarProfileMetaProperties:
     bar: Property = Property("Bar")
 
 
-def test_init_profile_meta_properties() -> None:
-    """Test initialization of self.profile_meta_properties."""
-    # default ProfileMetaProperties
+@pytest.mark.parametrize(
+    "attr, base, good, bad",
+    [
+        ("events", Events, FooEvents, BarEvents),
+        ("event_properties", EventProperties, FooEventProperties, BarEventProperties),
+        (
+            "profile_properties",
+            ProfileProperties,
+            FooProfileProperties,
+            BarProfileProperties,
+        ),
+        (
+            "profile_meta_properties",
+            ProfileMetaProperties,
+            FooProfileMetaProperties,
+            BarProfileMetaProperties,
+        ),
+    ],
+)
+def test_init_events_and_properties(
+    attr: str, base: type, good: type, bad: type
+) -> None:
+    """Test initialization of self.events and self.*_properties."""
+    setting = f"mixpanel.{attr}"
+
+    # default Events or *Properties
     mixpanel = MixpanelTrack(settings={})
-    assert mixpanel.profile_meta_properties == ProfileMetaProperties()
+    assert getattr(mixpanel, attr) == base()
 
     # resolved from a dotted-name
-    mixpanel = MixpanelTrack(
-        settings={
-            "mixpanel.profile_meta_properties": "pyramid_mixpanel.tests.test_track.FooProfileMetaProperties"
-        }
-    )
-    assert mixpanel.profile_meta_properties == FooProfileMetaProperties()
+    settings: SettingsType = {
+        setting: f"pyramid_mixpanel.tests.test_track.{good.__name__}"
+    }
+    mixpanel = MixpanelTrack(settings=settings)
+    assert getattr(mixpanel, attr) == good()
 
-    # the resolved ProfileMetaProperties need to be based off of
-    # pyramid_mixpanel.ProfileMetaProperties to contain the profile properties
-    # that this library expects
+    # the resolved class needs to be based off of the one in pyramid_mixpanel
+    # to contain the events or properties that this library expects
     with pytest.raises(ValueError) as exc:
-        mixpanel = MixpanelTrack(
-            settings={
-                "mixpanel.profile_meta_properties": "pyramid_mixpanel.tests.test_track.BarProfileMetaProperties"
-            }
-        )
+        settings = {setting: f"pyramid_mixpanel.tests.test_track.{bad.__name__}"}
+        mixpanel = MixpanelTrack(settings=settings)
     assert (
         str(exc.value)
-        == "class in dotted_name needs to be based on pyramid_mixpanel.ProfileMetaProperties"
+        == f"class in dotted_name needs to be based on pyramid_mixpanel.{base.__name__}"
     )
 
-    # passing ProfileMetaProperties as an object is not (yet) supported
+    # passing Events or *Properties as an object is not (yet) supported
     with pytest.raises(ValueError) as exc:
-        mixpanel = MixpanelTrack(
-            settings={
-                "mixpanel.profile_meta_properties": FooProfileMetaProperties()  # type: ignore
-            }
-        )
-    assert (
-        str(exc.value)
-        == "dotted_name must be a string, but it is: FooProfileMetaProperties"
-    )
+        mixpanel = MixpanelTrack(settings={setting: good()})  # type: ignore
+    assert str(exc.value) == f"dotted_name must be a string, but it is: {good.__name__}"
 
 
 def test_track() -> None:
@@ -345,6 +292,18 @@ def test_track() -> None:
     ]
     m.mocked_messages.clear()
 
+    # the shortcut can be replaced, like any other attribute, and the
+    # replacement does not receive the consumer's messages
+    replaced: t.List = []
+    m.mocked_messages = replaced
+    assert m.mocked_messages is replaced
+    m.track(Events.page_viewed)
+    assert replaced == []
+    consumer_messages = m.api._consumer.mocked_messages  # noqa: SF01
+    assert len(consumer_messages) == 1
+    consumer_messages.clear()
+    m.mocked_messages = consumer_messages
+
     # default event with default properties
     m.track(
         Events.page_viewed,
@@ -592,6 +551,23 @@ def test_profile_set_customerio() -> None:
     ]
 
 
+@mock.patch.object(MockedConsumer, "STORE_MESSAGES", False)
+def test_customerio_skip_storing() -> None:
+    """Test that Customer.io messages are not stored if told so."""
+    m = MixpanelTrack(
+        settings={
+            "customerio.tracking.site_id": "foo",
+            "customerio.tracking.api_key": "secret",
+            "customerio.tracking.region": "eu",
+        },
+        distinct_id="foo",
+    )
+
+    m.track(Events.page_viewed)
+    m.profile_set({ProfileProperties.dollar_name: "FooBar"})
+    assert m.mocked_messages == []
+
+
 def test_profile_set_guards() -> None:
     """Test guards that make sure parameters sent to .profile_set() are good."""
 
@@ -639,9 +615,12 @@ def test_profile_set_date() -> None:
         distinct_id="foo",
     )
 
-    m.profile_set(
-        {ProfileProperties.dollar_created: datetime(2020, 2, 2, 1, 1)},
-    )
+    props = {ProfileProperties.dollar_created: datetime(2020, 2, 2, 1, 1)}
+    m.profile_set(props)
+
+    # passed props are left intact
+    assert props == {ProfileProperties.dollar_created: datetime(2020, 2, 2, 1, 1)}
+
     assert m.mocked_messages == [
         {
             "endpoint": "people",
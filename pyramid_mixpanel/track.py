@@ -1,11 +1,12 @@
 """Tracking user events and profiles."""
 
-from copy import deepcopy
 from datetime import datetime
+from functools import lru_cache
+from functools import partial
 from mixpanel import BufferedConsumer
 from mixpanel import Consumer
 from mixpanel import Mixpanel
-from pyramid.events import NewRequest
+from pyramid.decorator import reify
 from pyramid.path import DottedNameResolver
 from pyramid.request import Request
 from pyramid.response import Response
@@ -21,7 +22,55 @@ from pyramid_mixpanel.consumer import PoliteBufferedConsumer
 import typing as t
 
 SettingsType = t.Dict[str, t.Union[str, int, bool]]
-PropertiesType = t.Dict[Property, t.Union[str, int, bool]]
+PropertiesType = t.Dict[Property, t.Union[str, int, bool, datetime]]
+T = t.TypeVar("T")
+
+# MixpanelTrack attribute, the setting that can override it with a
+# dotted-name, and the class that the override needs to be based on
+_CONTAINERS: t.Tuple[t.Tuple[str, str, type], ...] = (
+    ("events", "mixpanel.events", Events),
+    ("event_properties", "mixpanel.event_properties", EventProperties),
+    ("profile_properties", "mixpanel.profile_properties", ProfileProperties),
+    (
+        "profile_meta_properties",
+        "mixpanel.profile_meta_properties",
+        ProfileMetaProperties,
+    ),
+)
+
+
+@lru_cache(maxsize=None)
+def _resolve(dotted_name: str) -> t.Any:
+    """Resolve a dotted-name into a Python object, only once per dotted-name."""
+    return DottedNameResolver().resolve(dotted_name)
+
+
+@lru_cache(maxsize=None)
+def _instance(cls: type) -> t.Any:
+    """Create an Events or *Properties object once and share it.
+
+    They are frozen, so all MixpanelTrack objects can use the same one.
+    """
+    return cls()
+
+
+# Sets of all Events or Properties defined on each container class. Keyed on
+# the class, because hashing a frozen dataclass instance hashes all of its
+# fields, while classes hash by identity.
+_MEMBERS: t.Dict[type, t.FrozenSet] = {}
+
+
+def _members(container: object) -> t.FrozenSet:
+    """Return a set of all Events or Properties defined on a container.
+
+    Membership checks then cost a hash lookup instead of comparing against
+    every defined Event or Property.
+    """
+    members = _MEMBERS.get(container.__class__)
+    if members is None:
+        members = frozenset(container.__dict__.values())
+        _MEMBERS[container.__class__] = members
+    return members
 
 
 def distinct_id_is_required(function: t.Callable) -> t.Callable:
@@ -54,99 +103,42 @@ class MixpanelTrack:
     profile_meta_properties: ProfileMetaProperties
 
     @staticmethod
-    def _resolve_events(dotted_name: t.Optional[object] = None) -> Events:
-        """Resolve a dotted-name into an Events object."""
+    def _resolve_container(dotted_name: t.Optional[object], base: t.Type[T]) -> T:
+        """Resolve a dotted-name into an Events or *Properties object."""
         if not dotted_name:
-            return Events()
+            return _instance(base)  # type: ignore
         if not isinstance(dotted_name, str):
             raise ValueError(
                 f"dotted_name must be a string, but it is: {dotted_name.__class__.__name__}"
             )
         else:
-            resolved = DottedNameResolver().resolve(dotted_name)
-            if not issubclass(resolved, Events):
+            resolved = _resolve(dotted_name)
+            if not issubclass(resolved, base):
                 raise ValueError(
-                    "class in dotted_name needs to be based on pyramid_mixpanel.Events"
+                    f"class in dotted_name needs to be based on pyramid_mixpanel.{base.__name__}"
                 )
-            return resolved()
-
-    @staticmethod
-    def _resolve_event_properties(
-        dotted_name: t.Optional[object] = None,
-    ) -> EventProperties:
-        """Resolve a dotted-name into an EventProperties object."""
-        if not dotted_name:
-            return EventProperties()
-        if not isinstance(dotted_name, str):
-            raise ValueError(
-                f"dotted_name must be a string, but it is: {dotted_name.__class__.__name__}"
-            )
-        else:
-            resolved = DottedNameResolver().resolve(dotted_name)
-            if not issubclass(resolved, EventProperties):
-                raise ValueError(
-                    "class in dotted_name needs to be based on pyramid_mixpanel.EventProperties"
-                )
-            return resolved()
-
-    @staticmethod
-    def _resolve_profile_properties(
-        dotted_name: t.Optional[object] = None,
-    ) -> ProfileProperties:
-        """Resolve a dotted-name into an ProfileProperties object."""
-        if not dotted_name:
-            return ProfileProperties()
-        if not isinstance(dotted_name, str):
-            raise ValueError(
-                f"dotted_name must be a string, but it is: {dotted_name.__class__.__name__}"
-            )
-        else:
-            resolved = DottedNameResolver().resolve(dotted_name)
-            if not issubclass(resolved, ProfileProperties):
-                raise ValueError(
-                    "class in dotted_name needs to be based on pyramid_mixpanel.ProfileProperties"
-                )
-            return resolved()
-
-    @staticmethod
-    def _resolve_profile_meta_properties(
-        dotted_name: t.Optional[object] = None,
-    ) -> ProfileMetaProperties:
-        """Resolve a dotted-name into an ProfileMetaProperties object."""
-        if not dotted_name:
-            return ProfileMetaProperties()
-        if not isinstance(dotted_name, str):
-            raise ValueError(
-                f"dotted_name must be a string, but it is: {dotted_name.__class__.__name__}"
-            )
-        else:
-            resolved = DottedNameResolver().resolve(dotted_name)
-            if not issubclass(resolved, ProfileMetaProperties):
-                raise ValueError(
-                    "class in dotted_name needs to be based on pyramid_mixpanel.ProfileMetaProperties"
-                )
-            return resolved()
+            return _instance(resolved)
 
     @staticmethod
     def _resolve_consumer(
         dotted_name: t.Optional[object] = None, use_structlog: t.Optional[bool] = False
-    ) -> Consumer:
-        """Resolve a dotted-name into a Consumer object."""
+    ) -> t.Callable[[], Consumer]:
+        """Resolve a dotted-name into a callable that creates a Consumer object."""
         if not dotted_name:
-            return PoliteBufferedConsumer(use_structlog)
+            return partial(PoliteBufferedConsumer, use_structlog)
         if not isinstance(dotted_name, str):
             raise ValueError(
                 f"dotted_name must be a string, but it is: {dotted_name.__class__.__name__}"
             )
         else:
-            resolved = DottedNameResolver().resolve(dotted_name)
+            resolved = _resolve(dotted_name)
             if not (
                 issubclass(resolved, Consumer) or issubclass(resolved, BufferedConsumer)
             ):
                 raise ValueError(
                     "class in dotted_name needs to be based on mixpanel.(Buffered)Consumer"
                 )
-            return resolved()
+            return resolved
 
     def __init__(
         self, settings: SettingsType, distinct_id=None, global_event_props=None
@@ -154,28 +146,14 @@ class MixpanelTrack:
         """Initialize API connector."""
         self.distinct_id = distinct_id
 
-        self.events = self._resolve_events(settings.get("mixpanel.events"))
-        self.event_properties = self._resolve_event_properties(
-            settings.get("mixpanel.event_properties")
-        )
-        self.profile_properties = self._resolve_profile_properties(
-            settings.get("mixpanel.profile_properties")
-        )
-        self.profile_meta_properties = self._resolve_profile_meta_properties(
-            settings.get("mixpanel.profile_meta_properties")
-        )
+        for attr, setting, base in _CONTAINERS:
+            setattr(self, attr, self._resolve_container(settings.get(setting), base))
 
         use_structlog = settings.get("pyramid_heroku.structlog", False) is True
-        consumer = self._resolve_consumer(
+        self._create_consumer = self._resolve_consumer(
             settings.get("mixpanel.consumer"), use_structlog
         )
-        if settings.get("mixpanel.token"):
-            self.api = Mixpanel(token=settings["mixpanel.token"], consumer=consumer)
-        else:
-            self.api = Mixpanel(token="testing", consumer=MockedConsumer())  # nosec
-
-            # shortcut for more readable test asserts
-            self.mocked_messages = self.api._consumer.mocked_messages
+        self._token = settings.get("mixpanel.token")
 
         if global_event_props:
             self.global_event_props = global_event_props
@@ -207,6 +185,24 @@ class MixpanelTrack:
         else:
             self.cio = None
 
+    @reify
+    def api(self) -> Mixpanel:
+        """Create the Mixpanel client on first use, not on every request."""
+        if self._token:
+            return Mixpanel(token=self._token, consumer=self._create_consumer())
+        else:
+            return Mixpanel(token="testing", consumer=MockedConsumer())  # nosec
+
+    @reify
+    def _mocked(self) -> bool:
+        """Return True if messages are only stored in MockedConsumer."""
+        return self.api._consumer.__class__ == MockedConsumer
+
+    @reify
+    def mocked_messages(self) -> t.List:
+        """Shortcut for more readable test asserts."""
+        return self.api._consumer.mocked_messages
+
     @distinct_id_is_required
     def track(
         self,
@@ -215,7 +211,7 @@ class MixpanelTrack:
         skip_customerio: bool = False,
     ) -> None:
         """Track a Mixpanel event."""
-        if event not in self.events.__dict__.values():
+        if event not in _members(self.events):
             raise ValueError(f"Event '{event}' is not a member of self.events")
 
         if props:
@@ -223,7 +219,7 @@ class MixpanelTrack:
         else:
             props = self.global_event_props
         for prop in props:
-            if prop not in self.event_properties.__dict__.values():
+            if prop not in _members(self.event_properties):
                 raise ValueError(
                     f"Property '{prop}' is not a member of self.event_properties"
                 )
@@ -242,10 +238,11 @@ class MixpanelTrack:
                 },
             }
 
-            if self.api._consumer.__class__ == MockedConsumer:
-                self.api._consumer.mocked_messages.append(
-                    {"endpoint": "customer.io", "msg": msg}
-                )
+            if self._mocked:
+                if self.api._consumer.STORE_MESSAGES:
+                    self.api._consumer.mocked_messages.append(
+                        {"endpoint": "customer.io", "msg": msg}
+                    )
             else:
                 self.cio.track(**msg)
 
@@ -266,37 +263,34 @@ class MixpanelTrack:
             meta = {}
 
         for prop in props:
-            if prop not in self.profile_properties.__dict__.values():
+            if prop not in _members(self.profile_properties):
                 raise ValueError(
                     f"Property '{prop}' is not a member of self.profile_properties"
                 )
 
         for prop in meta:
-            if prop not in self.profile_meta_properties.__dict__.values():
+            if prop not in _members(self.profile_meta_properties):
                 raise ValueError(
                     f"Property '{prop}' is not a member of self.profile_meta_properties"
                 )
 
-        # mixpanel and customerio expect different date formats
-        # so we have to save the props here so we can format them
-        # differently later on in the `if self.cio:` block
-        customerio_props = deepcopy(props)
-
-        for (prop, value) in props.items():
-            if isinstance(value, datetime):
-                props[prop] = value.isoformat()
-
+        # mixpanel and customerio expect different date formats, so we
+        # format dates for each of them separately, without changing `props`
         self.api.people_set(
             self.distinct_id,
-            {prop.name: value for (prop, value) in props.items()},
+            {
+                prop.name: value.isoformat() if isinstance(value, datetime) else value
+                for (prop, value) in props.items()
+            },
             {prop.name: value for (prop, value) in meta.items()},
         )
         if self.cio and not skip_customerio:
 
             # customer.io expects dates in unix/epoch format
-            for prop, value in customerio_props.items():
-                if isinstance(value, datetime):
-                    customerio_props[prop] = round(value.timestamp())
+            customerio_props = {
+                prop: round(value.timestamp()) if isinstance(value, datetime) else value
+                for (prop, value) in props.items()
+            }
 
             # customer.io expects created timestamp as `created_at`
             if customerio_props.get(Property("$created")):
@@ -314,10 +308,11 @@ class MixpanelTrack:
                 **{prop.name.replace("$", ""): value for (prop, value) in meta.items()},
             }
 
-            if self.api._consumer.__class__ == MockedConsumer:
-                self.api._consumer.mocked_messages.append(
-                    {"endpoint": "customer.io", "msg": msg}
-                )
+            if self._mocked:
+                if self.api._consumer.STORE_MESSAGES:
+                    self.api._consumer.mocked_messages.append(
+                        {"endpoint": "customer.io", "msg": msg}
+                    )
             else:
                 self.cio.identify(**msg)
 
@@ -330,13 +325,13 @@ class MixpanelTrack:
             meta = {}
 
         for prop in props:
-            if prop not in self.profile_properties.__dict__.values():
+            if prop not in _members(self.profile_properties):
                 raise ValueError(
                     f"Property '{prop}' is not a member of self.profile_properties"
                 )
 
         for prop in meta:
-            if prop not in self.profile_meta_properties.__dict__.values():
+            if prop not in _members(self.profile_meta_properties):
                 raise ValueError(
                     f"Property '{prop}' is not a member of self.profile_meta_properties"
                 )
@@ -356,7 +351,7 @@ class MixpanelTrack:
             meta = {}
 
         for prop in props:
-            if prop not in self.profile_properties.__dict__.values():
+            if prop not in _members(self.profile_properties):
                 raise ValueError(
                     f"Property '{prop}' is not a member of self.profile_properties"
                 )
@@ -364,7 +359,7 @@ class MixpanelTrack:
                 raise TypeError(f"Property '{prop}' value is not a list")
 
         for prop in meta:
-            if prop not in self.profile_meta_properties.__dict__.values():
+            if prop not in _members(self.profile_meta_properties):
                 raise ValueError(
                     f"Property '{prop}' is not a member of self.profile_meta_properties"
                 )
@@ -381,7 +376,7 @@ class MixpanelTrack:
     def profile_increment(self, props: t.Dict[Property, int]) -> None:
         """Wrap around api.people_increment to set distinct_id."""
         for prop in props:
-            if prop not in self.profile_properties.__dict__.values():
+            if prop not in _members(self.profile_properties):
                 raise ValueError(
                     f"Property '{prop}' is not a member of self.profile_properties"
                 )
@@ -399,7 +394,7 @@ class MixpanelTrack:
             props = {}
 
         for prop in props:
-            if prop not in self.profile_properties.__dict__.values():
+            if prop not in _members(self.profile_properties):
                 raise ValueError(
                     f"Property '{prop}' is not a member of self.profile_properties"
                 )
@@ -452,20 +447,19 @@ def mixpanel_init(request: Request) -> MixpanelTrack:
                     )
     mixpanel.global_event_props = event_props_from_header
 
+    request.add_response_callback(mixpanel_flush)
     return mixpanel
 
 
-def mixpanel_flush(event: NewRequest) -> None:
-    """Send out all pending messages on Pyramid request end."""
+def mixpanel_flush(request: Request, response: Response) -> None:
+    """Send all the enqueued messages at the end of request lifecycle.
 
-    def flush(request: Request, response: Response) -> None:
-        """Send all the enqueued messages at the end of request lifecycle."""
-
-        # If request.mixpanel was never called during request runtime, then
-        # skip initializing and flushing MixpanelTrack.
-        if "mixpanel" not in request.__dict__:
-            return
-
-        request.mixpanel.api._consumer.flush()
+    Registered as a response callback by mixpanel_init, so only requests
+    that use request.mixpanel pay for it.
+    """
+    # If the Mixpanel client was never used during request runtime, then
+    # skip initializing and flushing it.
+    if "api" not in request.mixpanel.__dict__:
+        return
 
-    event.request.add_response_callback(flush)
+    request.mixpanel.api._consumer.flush()
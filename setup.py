@@ -70,6 +70,7 @@ setup(
     install_requires=["pyramid", "requests", "mixpanel", "customerio"],
     extras_require={
         "customerio": ["customerio"],
+        "orjson": ["orjson"],
     },
     cmdclass={"verify": VerifyVersionCommand},
 )